@@ -38,19 +38,96 @@ Use portfolios/perfect_with_SNP500.yaml for comprehensive global coverage.
 """
 
 import argparse
-import json
-
+import hashlib
+import html
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import orjson
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
 
 from utils import (
+    coverage_counts,
     get_countries_for_sector,
     load_regions,
     read_yaml,
     validate_portfolio_sectors,
 )
 
+CACHE_DIR = Path(".imid_cache")
+CACHE_EXPIRY_SECONDS = 86400  # re-fetch at most once a day
+
+# fast path: pull the breakdown input's value attribute straight out of the
+# raw HTML bytes without building a parse tree or decoding the whole page
+_BREAKDOWN_RE = re.compile(rb'id="fund-geographical-breakdown"[^>]*\svalue=("[^"]*"|\'[^\']*\')')
+
+_SESSION = None
+
+
+def _get_session():
+    """
+    Return a shared requests.Session, created on first use.
+
+    The session keeps connections alive across requests and identifies the
+    tool; requests is imported lazily so cached runs never pay for it.
+    """
+    global _SESSION
+    if _SESSION is None:
+        import requests
+
+        _SESSION = requests.Session()
+        _SESSION.headers.update({"User-Agent": "portfolio_diversity"})
+    return _SESSION
+
+
+def _fetch_breakdown_json(url, timeout):
+    """
+    Return the geographical-breakdown JSON payload for a URL, cached on disk
+    for a day.
+
+    Only the extracted payload is cached (not the multi-MB page), so repeated
+    runs (e.g. iterative portfolio tuning) skip both the download and the
+    HTML parse.
+
+    Returns:
+        str: JSON payload from the 'fund-geographical-breakdown' element
+    """
+    CACHE_DIR.mkdir(exist_ok=True)
+    cache_file = CACHE_DIR / (hashlib.md5(url.encode()).hexdigest() + ".json")
+
+    if cache_file.exists() and time.time() - cache_file.stat().st_mtime < CACHE_EXPIRY_SECONDS:
+        print(f"Using cached data for {url}")
+        return cache_file.read_text()
+
+    response = _get_session().get(url, timeout=timeout)
+    response.raise_for_status()
+
+    # work on the raw bytes; only the matched payload is ever decoded
+    match = _BREAKDOWN_RE.search(response.content)
+    if match:
+        payload = html.unescape(match.group(1)[1:-1].decode("utf-8"))
+    else:
+        # regex missed (attribute order or quoting changed): fall back to a
+        # full parse before giving up
+        from lxml import html as lxml_html
+
+        tree = lxml_html.fromstring(response.content)
+        json_values = tree.xpath('//input[@id="fund-geographical-breakdown"]/@value')
+
+        if not json_values:
+            raise ValueError(
+                "Could not find 'fund-geographical-breakdown' element on the webpage. "
+                "The website structure may have changed."
+            )
+
+        # str() unwraps lxml's smart-string subclass, which orjson rejects
+        payload = str(json_values[0])
+    cache_file.write_text(payload)
+    return payload
+
 
 def fetch_country_weights(url, timeout=30):
     """
@@ -66,166 +143,161 @@ def fetch_country_weights(url, timeout=30):
     Raises:
         Exception: If data fetching or parsing fails
     """
+    import requests
+
     try:
         print(f"Fetching data from {url}")
-        response = requests.get(url, timeout=timeout)
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        json_input = soup.find("input", id="fund-geographical-breakdown")
-
-        if not json_input:
-            raise ValueError(
-                "Could not find 'fund-geographical-breakdown' element on the webpage. "
-                "The website structure may have changed."
-            )
-
-        json_data = json.loads(json_input["value"])
+        json_data = orjson.loads(_fetch_breakdown_json(url, timeout))
         table_data = json_data.get("attrArray", [])
 
         if not table_data:
             raise ValueError("No country data found in the JSON response")
 
-        # Build DataFrame
-        df = pd.DataFrame(columns=["Country", "Weight"])
-        df["Country"] = [item["name"]["value"] for item in table_data]
-        df["Weight"] = [float(item["weight"]["value"][:-1]) for item in table_data]
+        # Build the columns directly: strip the trailing '%' and parse the
+        # weights in bulk instead of slicing and float()-ing per item
+        countries = [item["name"]["value"] for item in table_data]
+        raw_weights = np.array([item["weight"]["value"] for item in table_data])
+        weights = np.char.rstrip(raw_weights, "%").astype(np.float64)
+        df = pd.DataFrame({"Country": countries, "Weight": weights})
 
         print(f"Successfully fetched data for {len(df)} countries")
         return df
 
     except requests.RequestException as e:
         raise Exception(f"Failed to fetch data from {url}: {e}")
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         raise Exception(f"Failed to parse JSON data: {e}")
     except Exception as e:
         raise Exception(f"Error processing country weights: {e}")
 
 
 def calculate_portfolio_weights(
-    portfolio, all_countries, region_weights_series, country_weights_df, market_cap_pct
+    portfolio, sector_kind, region_weights_series, country_weights_df, sector_cap_cols, cap_pct_arr
 ):
     """
     Calculate weights for each sector in the portfolio.
 
     Args:
         portfolio (dict): Portfolio definition
-        all_countries (list): All available countries
+        sector_kind (dict): Sector to "world"/"region"/"country" classification
+            from validate_portfolio_sectors
         region_weights_series (pd.Series): Regional weights
         country_weights_df (pd.DataFrame): Country weights DataFrame
-        market_cap_pct (dict): Market cap percentages
+        sector_cap_cols (dict): Sector to cap array positions, built once in main
+        cap_pct_arr (np.ndarray): Market cap percentages indexed by cap position
 
     Returns:
         pd.DataFrame: Portfolio weights DataFrame
     """
-    portfolio_df = pd.DataFrame(
-        columns=["Sector", "Market Caps", "Absolute Weight (%)", "Normalized Weight (%)"]
+    cap_pcts = (
+        np.array([cap_pct_arr[sector_cap_cols[sector]].sum() for sector in portfolio]) / 100.0
+    )
+
+    sectors = list(portfolio.keys())
+    unknown = [sector for sector in sectors if sector not in sector_kind]
+    if unknown:
+        raise Exception(f"Warning: Sector '{unknown[0]}' not found in regions or countries.")
+
+    # one combined label -> weight lookup replaces the per-sector dispatch;
+    # region and country names are disjoint, and "All World" is the 100% total
+    lookup = pd.concat(
+        [
+            pd.Series({"All World": 100.0}),
+            region_weights_series,
+            country_weights_df.set_index("Country")["Weight"],
+        ]
     )
-    sector_weights = []
-
-    for sector, caps in portfolio.items():
-        cap_pct = sum([market_cap_pct[cap] for cap in caps])
-        sector_weight = 0.0  # Initialize to prevent UnboundLocalError
-
-        if sector == "All World":
-            # Special case: use total world weight (should be 100%)
-            sector_weight = 100.0 * (cap_pct / 100.0)
-        elif sector in region_weights_series.index:
-            sector_weight = region_weights_series[sector] * (cap_pct / 100.0)
-        elif sector in all_countries:
-            # Individual country
-            country_weight = country_weights_df[country_weights_df["Country"] == sector][
-                "Weight"
-            ].sum()
-            sector_weight = country_weight * (cap_pct / 100.0)
-        else:
-            raise Exception(f"Warning: Sector '{sector}' not found in regions or countries.")
-
-        sector_weights.append(sector_weight)
-
-    portfolio_df["Sector"] = list(portfolio.keys())
-    portfolio_df["Market Caps"] = list(portfolio.values())
-    total_weight = sum(sector_weights)
+    # validated countries that are absent from the weights data count as 0
+    base_weights = pd.Index(sectors).map(lookup).fillna(0.0).to_numpy(dtype=np.float64)
+
+    sector_weights = base_weights * cap_pcts
+    total_weight = sector_weights.sum()
     if total_weight > 0:
-        normalized_weights = [(w / total_weight) * 100 for w in sector_weights]
+        normalized_weights = sector_weights / total_weight * 100
     else:
-        normalized_weights = [0.0] * len(sector_weights)
+        normalized_weights = np.zeros_like(sector_weights)
 
-    portfolio_df["Absolute Weight (%)"] = sector_weights
-    portfolio_df["Normalized Weight (%)"] = normalized_weights
+    portfolio_df = pd.DataFrame(
+        {
+            "Sector": list(portfolio.keys()),
+            "Market Caps": list(portfolio.values()),
+            "Absolute Weight (%)": sector_weights,
+            "Normalized Weight (%)": normalized_weights,
+        }
+    )
     return portfolio_df
 
 
 def analyze_world_coverage(
-    portfolio, country_weights, region_groupings, all_countries, market_cap_pct
+    portfolio,
+    weights_arr,
+    country_idx,
+    region_groupings,
+    all_countries,
+    cap_idx,
+    cap_pct_arr,
+    sector_cap_cols,
 ):
     """
     Check portfolio coverage against world markets.
 
     Args:
         portfolio (dict): Portfolio definition
-        country_weights (dict): Country weight mappings
+        weights_arr (np.ndarray): Country weights aligned with country_idx
+        country_idx (dict): Country to weights_arr position mapping
         region_groupings (dict): Region to countries mapping
         all_countries (list): All available countries
-        market_cap_pct (dict): Market cap percentages
+        cap_idx (dict): Market cap name to array position mapping
+        cap_pct_arr (np.ndarray): Market cap percentages aligned with cap_idx
+        sector_cap_cols (dict): Sector to cap array positions, built once in main
 
     Returns:
         dict: Coverage analysis results
     """
-    cap_coverage = {}
-    pct_coverage = {}
+    # Per-country coverage is a count vector over market caps so missing/overlap
+    # detection is vectorized instead of list scans per cap
+    cap_names = list(cap_idx.keys())
+
+    # resolve each sector's countries once, before the accumulation loop
+    sector_countries = {
+        sector: get_countries_for_sector(sector, region_groupings, all_countries)
+        for sector in portfolio
+    }
 
-    for sector, caps in portfolio.items():
-        countries = get_countries_for_sector(sector, region_groupings, all_countries)
+    countries_list = list(country_idx.keys())
 
+    for sector, countries in sector_countries.items():
         if not countries:
             raise Exception(f"Unknown sector '{sector}' - skipping")
-
         for country in countries:
-            if country not in country_weights:
+            if country not in country_idx:
                 raise Exception(f"Country '{country}' not found in weights data")
 
-            if country not in cap_coverage:
-                cap_coverage[country] = sorted(caps)
-                pct_coverage[country] = sum(
-                    [(country_weights[country] / 100.0) * market_cap_pct[cap] for cap in caps]
-                )
-            else:
-                cap_coverage[country] = sorted(cap_coverage[country] + caps)
-                pct_coverage[country] += sum(
-                    [(country_weights[country] / 100.0) * market_cap_pct[cap] for cap in caps]
-                )
-
-    # Check for overlaps and missing coverage
+    counts_mat = coverage_counts(portfolio, sector_countries, country_idx, cap_idx, sector_cap_cols)
+
+    # Missing/overlap masks and their percentage totals come out of
+    # whole-matrix reductions; names are only materialized for reported rows.
+    weights_frac = weights_arr / 100.0
+
+    missing_mat = counts_mat == 0
+    overlap_mat = counts_mat > 1
+    missing_pct_arr = weights_frac * (missing_mat @ cap_pct_arr)
+    overlap_pct_arr = weights_frac * (overlap_mat @ cap_pct_arr)
+
     overlapping_caps = {}
     missing_caps = {}
     overlapping_pct = {}
     missing_pct = {}
 
-    all_caps = list(market_cap_pct.keys())
-    for country, weight in country_weights.items():
-        if country not in cap_coverage:
-            cap_coverage[country] = []
-
-        missing_caps_cur = [element for element in all_caps if element not in cap_coverage[country]]
-        if missing_caps_cur:
-            missing_caps[country] = missing_caps_cur
-            missing_pct[country] = sum(
-                [
-                    (country_weights[country] / 100.0) * market_cap_pct[cap]
-                    for cap in missing_caps_cur
-                ]
-            )
+    for i in np.flatnonzero(missing_mat.any(axis=1)):
+        country = countries_list[i]
+        missing_caps[country] = [cap_names[j] for j in np.flatnonzero(missing_mat[i])]
+        missing_pct[country] = float(missing_pct_arr[i])
 
-        extra_caps_cur = []
-        for element in all_caps:
-            if cap_coverage[country].count(element) > 1:
-                extra_caps_cur.append(element)
-        if extra_caps_cur:
-            overlapping_caps[country] = extra_caps_cur
-            overlapping_pct[country] = sum(
-                [(country_weights[country] / 100.0) * market_cap_pct[cap] for cap in extra_caps_cur]
-            )
+    for i in np.flatnonzero(overlap_mat.any(axis=1)):
+        country = countries_list[i]
+        overlapping_caps[country] = [cap_names[j] for j in np.flatnonzero(overlap_mat[i])]
+        overlapping_pct[country] = float(overlap_pct_arr[i])
 
     return {
         "missing_caps": missing_caps,
@@ -236,40 +308,47 @@ def analyze_world_coverage(
 
 
 def print_coverage_report(results, portfolio_df):
-    """Print coverage analysis report."""
+    """Print coverage analysis report as a single buffered write."""
     missing_caps = results["missing_caps"]
     missing_pct = results["missing_pct"]
     overlapping_caps = results["overlapping_caps"]
     overlapping_pct = results["overlapping_pct"]
 
+    total_coverage = portfolio_df["Absolute Weight (%)"].sum()
+    lines = []
+
     if not missing_caps and not overlapping_caps:
-        print(
-            f"Total market coverage={portfolio_df['Absolute Weight (%)'].sum():.2f}%. No overlaps or missing segments."
+        lines.append(
+            f"Total market coverage={total_coverage:.2f}%. No overlaps or missing segments."
         )
 
     if missing_caps:
-        print(f"Missing segments: {missing_caps}")
-        print(f"Missing coverage: {missing_pct}")
-        print(
-            f"Total market coverage={portfolio_df['Absolute Weight (%)'].sum():.2f}%, "
+        lines.append(f"Missing segments: {missing_caps}")
+        lines.append(f"Missing coverage: {missing_pct}")
+        lines.append(
+            f"Total market coverage={total_coverage:.2f}%, "
             f"Total missed coverage: {sum(missing_pct.values()):.2f}%"
         )
 
     if overlapping_caps:
-        print(f"Overlapping segments: {overlapping_caps}")
-        print(f"Overlapping coverage: {overlapping_pct}")
-        print(
-            f"Total market coverage={portfolio_df['Absolute Weight (%)'].sum():.2f}%, "
+        lines.append(f"Overlapping segments: {overlapping_caps}")
+        lines.append(f"Overlapping coverage: {overlapping_pct}")
+        lines.append(
+            f"Total market coverage={total_coverage:.2f}%, "
             f"Total overlapping coverage: {sum(overlapping_pct.values()):.2f}%"
         )
 
+    sys.stdout.write("\n".join(lines) + "\n")
 
-def main(file_path):
+
+def main(file_path, sort=True):
     """
     Main execution function.
 
     Args:
         file_path (str): Path to portfolio YAML file
+        sort (bool): Sort region weights for display. Batch callers that sweep
+            many portfolios and only sort a combined report can pass False.
     """
     # load configurations
     region_groupings, all_countries = load_regions()
@@ -277,11 +356,23 @@ def main(file_path):
     market_cap_pct = config["market_caps"]
     imid_url = config["data_sources"]["url"]
 
+    # encode market caps as an index map + aligned percentage vector once,
+    # shared by the weight and coverage computations
+    cap_idx = {name: i for i, name in enumerate(market_cap_pct)}
+    cap_pct_arr = np.fromiter(market_cap_pct.values(), dtype=np.float64)
+
     # load portfolio definition:
     portfolio = read_yaml(file_path)
 
+    # encode each sector's caps as array positions once; shared by the weight
+    # and coverage computations
+    sector_cap_cols = {
+        sector: np.array([cap_idx[cap] for cap in caps], dtype=np.intp)
+        for sector, caps in portfolio.items()
+    }
+
     # validate portfolio sectors
-    valid_sectors, invalid_sectors = validate_portfolio_sectors(
+    valid_sectors, invalid_sectors, sector_kind = validate_portfolio_sectors(
         portfolio, region_groupings, all_countries
     )
     if invalid_sectors:
@@ -292,43 +383,74 @@ def main(file_path):
     # fetch country weights from IMID
     country_weights_df = fetch_country_weights(imid_url)
 
-    # add missing countries with 0 weight
-    missing_countries = set(all_countries) - set(country_weights_df["Country"])
-    if missing_countries:
+    # add missing countries with 0 weight; reindexing against the appended
+    # index fills them in one allocation instead of a second frame plus concat
+    weights_by_country = country_weights_df.set_index("Country")["Weight"]
+    missing_countries = pd.Index(all_countries).difference(weights_by_country.index)
+    if not missing_countries.empty:
         print(
-            f"Adding {len(missing_countries)} missing countries with 0% weight: {missing_countries}"
+            f"Adding {len(missing_countries)} missing countries with 0% weight: "
+            f"{list(missing_countries)}"
         )
-        for country in missing_countries:
-            country_weights_df.loc[len(country_weights_df)] = {"Country": country, "Weight": 0.00}
-
-    # build region weights by grouping countries
-    region_weights = {}
-    for region_name, countries in region_groupings.items():
-        region_weight = country_weights_df[country_weights_df["Country"].isin(countries)][
-            "Weight"
-        ].sum()
-        region_weights[region_name] = region_weight
-
-    region_weights_series = pd.Series(region_weights).sort_values(ascending=False)
-
-    print("Region Weights:")
-    print(region_weights_series)
+        weights_by_country = weights_by_country.reindex(
+            weights_by_country.index.append(missing_countries), fill_value=0.0
+        )
+        country_weights_df = weights_by_country.rename_axis("Country").reset_index()
+
+    # build region weights with a single hashed groupby instead of one isin scan per region;
+    # a (Region, Country) membership table handles countries that belong to several regions
+    membership = pd.DataFrame(
+        [
+            (region, country)
+            for region, countries in region_groupings.items()
+            for country in countries
+        ],
+        columns=["Region", "Country"],
+    )
+    # the grouping key repeats one of a handful of region names per row;
+    # categorical codes let the groupby hash integers instead of strings
+    membership["Region"] = membership["Region"].astype("category")
+    membership["Weight"] = membership["Country"].map(weights_by_country)
+    region_weights_series = membership.groupby("Region", observed=True, sort=False)["Weight"].sum()
+    if sort:
+        region_weights_series = region_weights_series.sort_values(ascending=False)
 
     # calculate portfolio weights
     portfolio_df = calculate_portfolio_weights(
-        portfolio, all_countries, region_weights_series, country_weights_df, market_cap_pct
+        portfolio,
+        sector_kind,
+        region_weights_series,
+        country_weights_df,
+        sector_cap_cols,
+        cap_pct_arr,
     )
 
-    print("\nPortfolio Weights:")
-    print(portfolio_df.to_string(index=False))
-
-    # analyze coverage
-    country_weights = country_weights_df.set_index("Country")["Weight"].to_dict()
+    # batch the report into one write; each print of a pandas object would
+    # otherwise pay formatter setup on its own
+    parts = [
+        "Region Weights:",
+        region_weights_series.to_string(),
+        "",
+        "Portfolio Weights:",
+        portfolio_df.to_string(index=False),
+    ]
+    sys.stdout.write("\n".join(parts) + "\n")
+
+    # analyze coverage: aligned array + index map instead of a dict of weights
+    weights_arr = country_weights_df["Weight"].to_numpy()
+    country_idx = {country: i for i, country in enumerate(country_weights_df["Country"])}
     results = analyze_world_coverage(
-        portfolio, country_weights, region_groupings, all_countries, market_cap_pct
+        portfolio,
+        weights_arr,
+        country_idx,
+        region_groupings,
+        all_countries,
+        cap_idx,
+        cap_pct_arr,
+        sector_cap_cols,
     )
 
-    print("\n" + "=" * 50)
+    sys.stdout.write("\n" + "=" * 50 + "\n")
     print_coverage_report(results, portfolio_df)
 
 
@@ -8,7 +8,7 @@ Or specific test: python tests.py TestCoverage.test_perfect_portfolio
 import sys
 import unittest
 
-from utils import get_countries_for_sector, load_regions, read_yaml
+from utils import coverage_counts, get_countries_for_sector, load_regions, read_yaml
 
 
 class TestCoverage(unittest.TestCase):
@@ -20,6 +20,12 @@ class TestCoverage(unittest.TestCase):
         cls.region_groupings, cls.all_countries = load_regions()
         cls.config = read_yaml("config.yaml")
         cls.market_cap_pct = cls.config["market_caps"]
+        # one prebuilt lookup instead of per-sector membership cascades
+        cls.sector_to_countries = {
+            **{country: [country] for country in cls.all_countries},
+            **cls.region_groupings,
+            "All World": cls.all_countries,
+        }
 
     def check_world_coverage(self, portfolio):
         """
@@ -29,30 +35,43 @@ class TestCoverage(unittest.TestCase):
         Returns:
             tuple: (is_perfect, coverage_details)
         """
-        cap_coverage = {}
-
-        for sector, caps in portfolio.items():
-            countries = get_countries_for_sector(sector, self.region_groupings, self.all_countries)
-
+        sector_countries = {
+            sector: self.sector_to_countries.get(sector, []) for sector in portfolio
+        }
+
+        # covered countries in first-seen order, matching the old dict insertion order
+        covered_countries = []
+        seen = set()
+        for countries in sector_countries.values():
             for country in countries:
-                if country not in cap_coverage:
-                    cap_coverage[country] = sorted(caps)
-                else:
-                    cap_coverage[country] = sorted(cap_coverage[country] + caps)
+                if country not in seen:
+                    seen.add(country)
+                    covered_countries.append(country)
 
-        if not cap_coverage:
+        if not covered_countries:
             return False, "No coverage found"
 
+        country_rows = {country: i for i, country in enumerate(covered_countries)}
+        cap_cols = {cap: i for i, cap in enumerate(self.market_cap_pct)}
+        cap_names = list(cap_cols)
+        counts = coverage_counts(portfolio, sector_countries, country_rows, cap_cols)
+
+        def row_caps(row):
+            """Expand a count row back to the sorted cap-name list."""
+            return sorted(cap for cap, n in zip(cap_names, row) for _ in range(n))
+
         # Expected full coverage: all market cap types
         expected_coverage = sorted(list(self.market_cap_pct.keys()))
 
         # Check if all countries have identical AND complete coverage
-        cap_coverage_values = list(cap_coverage.values())
-        first_value = cap_coverage_values[0]
-        all_same = all(val == first_value for val in cap_coverage_values)
+        first_value = row_caps(counts[0])
+        all_same = bool((counts == counts[0]).all())
 
         if all_same and first_value == expected_coverage:
-            return True, f"Perfect coverage: all {len(cap_coverage)} countries have {first_value}"
+            return (
+                True,
+                f"Perfect coverage: all {len(covered_countries)} countries have {first_value}",
+            )
         elif all_same and first_value != expected_coverage:
             missing = set(expected_coverage) - set(first_value)
             extra = set(first_value) - set(expected_coverage)
@@ -67,9 +86,9 @@ class TestCoverage(unittest.TestCase):
             )
         else:
             inconsistent = {
-                country: coverage
-                for country, coverage in cap_coverage.items()
-                if coverage != first_value
+                country: row_caps(counts[row])
+                for country, row in country_rows.items()
+                if not (counts[row] == counts[0]).all()
             }
             return False, f"Inconsistent coverage: {inconsistent}"
 
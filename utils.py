@@ -4,13 +4,28 @@ Utility functions for portfolio diversity calculation.
 Handles file I/O, configuration loading, and portfolio validation.
 """
 
+import functools
+
+import numpy as np
 import yaml
 
+try:
+    # libyaml-backed loader parses in C, several times faster than pure Python
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
 
+@functools.lru_cache(maxsize=None)
 def read_yaml(file_path):
-    """Read YAML file."""
+    """
+    Read YAML file.
+
+    Results are cached per path, so repeated reads of e.g. config.yaml
+    parse once per process. Callers must not mutate the returned data.
+    """
     with open(file_path, "r") as file:
-        return yaml.safe_load(file)
+        return yaml.load(file, Loader=_SafeLoader)
 
 
 def load_regions(regions_file="regions.yaml"):
@@ -23,10 +38,9 @@ def load_regions(regions_file="regions.yaml"):
     region_groupings = read_yaml(regions_file)
 
     # Get all unique countries
-    all_countries = set()
-    for countries in region_groupings.values():
-        all_countries.update(countries)
-    all_countries = sorted(list(all_countries))
+    all_countries = sorted(
+        {country for countries in region_groupings.values() for country in countries}
+    )
 
     return region_groupings, all_countries
 
@@ -35,19 +49,66 @@ def validate_portfolio_sectors(portfolio, region_groupings, all_countries):
     """
     Validate that all portfolio sectors exist in the data.
 
+    Also classifies each valid sector by its source so downstream code can
+    dispatch with a single dict lookup instead of repeating membership tests.
+
     Returns:
-        tuple: (valid_sectors, invalid_sectors)
+        tuple: (valid_sectors, invalid_sectors, sector_kind) where sector_kind
+            maps each valid sector to "world", "region" or "country"
     """
     valid_sectors = []
     invalid_sectors = []
+    sector_kind = {}
+    # hash membership once instead of scanning the country list per sector
+    country_set = frozenset(all_countries)
 
     for sector in portfolio.keys():
-        if sector in region_groupings or sector in all_countries or sector == "All World":
-            valid_sectors.append(sector)
+        if sector == "All World":
+            sector_kind[sector] = "world"
+        elif sector in region_groupings:
+            sector_kind[sector] = "region"
+        elif sector in country_set:
+            sector_kind[sector] = "country"
         else:
             invalid_sectors.append(sector)
+            continue
+        valid_sectors.append(sector)
+
+    return valid_sectors, invalid_sectors, sector_kind
+
 
-    return valid_sectors, invalid_sectors
+def coverage_counts(portfolio, sector_countries, country_rows, cap_cols, sector_cap_cols=None):
+    """
+    Build a (countries x caps) matrix counting how many portfolio sectors
+    cover each country/cap cell.
+
+    Shared by the coverage analysis and the test suite: missing coverage is
+    a zero cell, overlap is a count above one, and perfect coverage is a
+    matrix of ones.
+
+    Args:
+        portfolio (dict): Sector to market caps mapping
+        sector_countries (dict): Sector to countries mapping
+        country_rows (dict): Country to matrix row mapping
+        cap_cols (dict): Market cap name to matrix column mapping
+        sector_cap_cols (dict, optional): Precomputed sector to cap column
+            positions; derived from portfolio and cap_cols when omitted
+
+    Returns:
+        np.ndarray: uint8 count matrix of shape (len(country_rows), len(cap_cols))
+    """
+    if sector_cap_cols is None:
+        sector_cap_cols = {
+            sector: [cap_cols[cap] for cap in caps] for sector, caps in portfolio.items()
+        }
+
+    counts = np.zeros((len(country_rows), len(cap_cols)), dtype=np.uint8)
+    for sector, countries in sector_countries.items():
+        sector_mask = np.zeros(len(cap_cols), dtype=np.uint8)
+        np.add.at(sector_mask, sector_cap_cols[sector], 1)
+        counts[[country_rows[country] for country in countries]] += sector_mask
+
+    return counts
 
 
 def get_countries_for_sector(sector, region_groupings, all_countries):
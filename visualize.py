@@ -9,66 +9,90 @@ Usage:
 """
 
 import argparse
+import functools
 import sys
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 
-from calculate_portfolio_weights import fetch_country_weights
-from utils import get_countries_for_sector, load_regions, read_yaml
+from utils import coverage_counts, get_countries_for_sector, load_regions, read_yaml
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_weights(url):
+    """
+    Fetch country weights once per URL per process.
+
+    Rendering several portfolios in one run re-parses the same weights
+    otherwise. Callers must not mutate the returned DataFrame in place.
+    """
+    # imported here so --help and argparse error paths skip the heavy import
+    from calculate_portfolio_weights import fetch_country_weights
+
+    return fetch_country_weights(url)
 
 
 def plot_coverage_heatmap(
-    portfolio, country_weights_df, region_groupings, all_countries, market_cap_pct, output_path=None
+    portfolio,
+    country_weights_df,
+    region_groupings,
+    all_countries,
+    market_cap_pct,
+    output_path=None,
+    sector_countries=None,
+    cap_types=None,
 ):
     """
     Create heatmap showing coverage status for each country and market cap segment.
 
     Args:
         portfolio: Portfolio definition dict
-        country_weights_df: DataFrame with country weights
+        country_weights_df: DataFrame with country weights, sorted by
+            descending Weight
         region_groupings: Region to countries mapping
         all_countries: List of all countries
         market_cap_pct: Market cap percentages dict
         output_path: Optional path to save the figure
+        sector_countries: Optional precomputed sector to countries mapping,
+            shared across plots to avoid resolving sectors twice
+        cap_types: Optional cap names sorted by descending market share,
+            likewise shared across plots
     """
-    # Build coverage matrix
-    cap_coverage = {}
-
-    for sector, caps in portfolio.items():
-        countries = get_countries_for_sector(sector, region_groupings, all_countries)
-
+    import matplotlib.pyplot as plt
+
+    if sector_countries is None:
+        sector_countries = {
+            sector: get_countries_for_sector(sector, region_groupings, all_countries)
+            for sector in portfolio
+        }
+
+    # Build coverage counts with the shared matrix helper instead of a
+    # dict-of-dicts; rows are covered countries in first-seen order
+    if cap_types is None:
+        cap_types = sorted(market_cap_pct.keys(), key=lambda x: market_cap_pct[x], reverse=True)
+    country_rows = {}
+    for countries in sector_countries.values():
         for country in countries:
-            if country not in cap_coverage:
-                cap_coverage[country] = {cap: 0 for cap in market_cap_pct.keys()}
-            for cap in caps:
-                cap_coverage[country][cap] += 1
-
-    # Select top countries by weight for visualization (otherwise too many)
-    top_countries = country_weights_df.nlargest(30, "Weight")["Country"].tolist()
-
-    # Build matrix for heatmap
-    cap_types = sorted(market_cap_pct.keys(), key=lambda x: market_cap_pct[x], reverse=True)
-    matrix_data = []
-    countries_in_matrix = []
-
-    for country in top_countries:
-        if country in cap_coverage:
-            row = [cap_coverage[country].get(cap, 0) for cap in cap_types]
-            matrix_data.append(row)
-            countries_in_matrix.append(country)
-
-    if not matrix_data:
+            if country not in country_rows:
+                country_rows[country] = len(country_rows)
+    cap_cols = {cap: j for j, cap in enumerate(cap_types)}
+    coverage = coverage_counts(portfolio, sector_countries, country_rows, cap_cols)
+
+    # Select top countries by weight for visualization (otherwise too many);
+    # the frame arrives sorted, so this is a plain slice
+    top_countries = country_weights_df.head(30)["Country"].tolist()
+    countries_in_matrix = [country for country in top_countries if country in country_rows]
+
+    # Color mapping: 0=red (missing), 1=green (covered), 2+=yellow (overlap);
+    # bail before any figure setup when there is nothing to draw
+    matrix = coverage[[country_rows[country] for country in countries_in_matrix]]
+    if not matrix.any():
         print("⚠️  No coverage data to visualize")
         return None
 
     # Create heatmap
     fig, ax = plt.subplots(figsize=(8, 12))
 
-    # Color mapping: 0=red (missing), 1=green (covered), 2+=yellow (overlap)
-    matrix = np.array(matrix_data)
-
     # Create custom colormap
     cmap = plt.cm.colors.ListedColormap(["#e74c3c", "#2ecc71", "#f39c12"])
     bounds = [-0.5, 0.5, 1.5, 2.5]
@@ -95,22 +119,15 @@ def plot_coverage_heatmap(
     ax.set_xlabel("Market Cap Segment", fontsize=11, fontweight="bold")
     ax.set_ylabel("Country", fontsize=11, fontweight="bold")
 
-    # Add text annotations
-    for i in range(len(countries_in_matrix)):
-        for j in range(len(cap_types)):
-            value = matrix[i, j]
-            if value == 0:
-                text = "✗"
-                color = "white"
-            elif value == 1:
-                text = "✓"
-                color = "white"
-            else:
-                text = f"{int(value)}x"
-                color = "black"
-            ax.text(
-                j, i, text, ha="center", va="center", color=color, fontsize=10, fontweight="bold"
-            )
+    # Add text annotations; labels and colors are precomputed arrays so the
+    # loop does nothing but create the artists, with shared styling kwargs
+    labels = np.where(
+        matrix == 0, "✗", np.where(matrix == 1, "✓", np.char.add(matrix.astype(str), "x"))
+    )
+    label_colors = np.where(matrix > 1, "black", "white")
+    text_kwargs = {"ha": "center", "va": "center", "fontsize": 10, "fontweight": "bold"}
+    for (i, j), label in np.ndenumerate(labels):
+        ax.text(j, i, label, color=label_colors[i, j], **text_kwargs)
 
     # Add colorbar legend
     cbar = plt.colorbar(im, ax=ax, ticks=[0, 1, 2])
@@ -121,6 +138,8 @@ def plot_coverage_heatmap(
     if output_path:
         plt.savefig(output_path, dpi=300, bbox_inches="tight")
         print(f"✅ Saved coverage heatmap to {output_path}")
+        # saved figures are never shown; close so batch renders stay O(1)
+        plt.close(fig)
     else:
         plt.show()
 
@@ -136,6 +155,8 @@ def plot_country_level_comparison(
     output_path=None,
     top_n=25,
     sort_ascending=True,
+    sector_countries=None,
+    cap_types=None,
 ):
     """
     Create detailed country-level comparison showing ideal vs actual allocation.
@@ -143,41 +164,56 @@ def plot_country_level_comparison(
 
     Args:
         portfolio: Portfolio definition dict
-        country_weights_df: DataFrame with country weights
+        country_weights_df: DataFrame with country weights, sorted by
+            descending Weight
         region_groupings: Region to countries mapping
         all_countries: List of all countries
         market_cap_pct: Market cap percentages dict
         output_path: Optional path to save the figure
         top_n: Number of top countries to display (default 25)
         sort_ascending: If True (default), largest countries at top; if False, smallest at top
+        sector_countries: Optional precomputed sector to countries mapping,
+            shared across plots to avoid resolving sectors twice
+        cap_types: Optional cap names sorted by descending market share,
+            likewise shared across plots
     """
-    # Calculate ideal allocation per country per cap
-    ideal_allocation = {}
-    for country in all_countries:
-        country_weight = country_weights_df[country_weights_df["Country"] == country]["Weight"]
-        if not country_weight.empty:
-            total_weight = country_weight.values[0]
-            ideal_allocation[country] = {
-                cap: total_weight * (market_cap_pct[cap] / 100.0) for cap in market_cap_pct.keys()
-            }
-
-    # Calculate actual portfolio allocation per country per cap
-    actual_allocation = {}
-    for sector, caps in portfolio.items():
-        countries = get_countries_for_sector(sector, region_groupings, all_countries)
+    import matplotlib.pyplot as plt
+
+    if sector_countries is None:
+        sector_countries = {
+            sector: get_countries_for_sector(sector, region_groupings, all_countries)
+            for sector in portfolio
+        }
+    # One hash map instead of a boolean-mask scan of the DataFrame per
+    # country (and again per sector x country below)
+    weights_map = dict(
+        zip(country_weights_df["Country"].to_numpy(), country_weights_df["Weight"].to_numpy())
+    )
 
-        for country in countries:
-            if country not in actual_allocation:
-                actual_allocation[country] = {cap: 0.0 for cap in market_cap_pct.keys()}
+    if cap_types is None:
+        cap_types = sorted(market_cap_pct.keys(), key=lambda x: market_cap_pct[x], reverse=True)
+    cap_frac = np.array([market_cap_pct[cap] for cap in cap_types]) / 100.0
+    country_idx = {country: i for i, country in enumerate(all_countries)}
+    # one aligned reindex instead of a per-country dict lookup loop
+    weights_vec = (
+        country_weights_df.set_index("Country")["Weight"]
+        .reindex(all_countries, fill_value=0.0)
+        .to_numpy()
+    )
 
-            country_weight = country_weights_df[country_weights_df["Country"] == country]["Weight"]
-            if not country_weight.empty:
-                total_weight = country_weight.values[0]
-                for cap in caps:
-                    actual_allocation[country][cap] += total_weight * (market_cap_pct[cap] / 100.0)
+    # Ideal allocation per country per cap is a single outer product;
+    # actual allocation accumulates one outer product per sector into the
+    # rows/caps it covers, instead of nested dict-of-dicts Python loops
+    ideal_matrix = np.outer(weights_vec, cap_frac)
+    actual_matrix = np.zeros_like(ideal_matrix)
+    for sector, caps in portfolio.items():
+        countries = sector_countries[sector]
+        rows = [country_idx[country] for country in countries]
+        cols = [cap_types.index(cap) for cap in caps]
+        actual_matrix[np.ix_(rows, cols)] += np.outer(weights_vec[rows], cap_frac[cols])
 
-    # Select top N countries by total weight
-    top_countries_df = country_weights_df.nlargest(top_n, "Weight")
+    # Select top N countries by total weight; the frame arrives sorted
+    top_countries_df = country_weights_df.head(top_n)
 
     # Sort according to parameter - note that y-axis is reversed (0 at top)
     # So ascending=True means largest countries have smallest y-values (appear at top)
@@ -190,34 +226,29 @@ def plot_country_level_comparison(
 
     top_countries = top_countries_df["Country"].tolist()
 
-    # Prepare data for plotting
-    cap_types = sorted(market_cap_pct.keys(), key=lambda x: market_cap_pct[x], reverse=True)
-
-    # Build data arrays
-    countries_list = []
-    ideal_totals = []
-    actual_totals = []
-    ideal_data = {cap: [] for cap in cap_types}
-    actual_data = {cap: [] for cap in cap_types}
-
-    for country in top_countries:
-        if country in ideal_allocation:
-            countries_list.append(country)
-
-            # Calculate totals
-            ideal_total = sum(ideal_allocation[country].values())
-            actual_total = sum(actual_allocation.get(country, {}).values())
-            ideal_totals.append(ideal_total)
-            actual_totals.append(actual_total)
-
-            for cap in cap_types:
-                ideal_data[cap].append(ideal_allocation[country].get(cap, 0))
-                actual_data[cap].append(actual_allocation.get(country, {}).get(cap, 0))
+    # Slice the displayed rows out of the allocation matrices; per-cap
+    # values and totals are then views and reductions, not rebuilt lists
+    countries_list = [
+        country for country in top_countries if country in country_idx and country in weights_map
+    ]
 
     if not countries_list:
         print("⚠️  No country data to visualize")
         return None
 
+    top_rows = [country_idx[country] for country in countries_list]
+    ideal_top = ideal_matrix[top_rows]
+    actual_top = actual_matrix[top_rows]
+    ideal_totals = ideal_top.sum(axis=1)
+    actual_totals = actual_top.sum(axis=1)
+
+    # Stack offsets for the bars come from one cumsum per matrix instead
+    # of accumulating a bottom array per cap in Python
+    ideal_left = np.zeros_like(ideal_top)
+    ideal_left[:, 1:] = np.cumsum(ideal_top[:, :-1], axis=1)
+    actual_left = np.zeros_like(actual_top)
+    actual_left[:, 1:] = np.cumsum(actual_top[:, :-1], axis=1)
+
     # Create single plot with two bars per country separated by white line
     fig, ax = plt.subplots(figsize=(14, 12))
 
@@ -228,35 +259,35 @@ def plot_country_level_comparison(
     bar_height = 0.35
     gap = 0.02  # Small white gap between the two bars
 
-    # Plot ideal allocation (top bar)
-    bottom_ideal = np.zeros(len(countries_list))
-    for cap in cap_types:
-        values = np.array(ideal_data[cap])
-        ax.barh(
+    # Plot ideal allocation (top bar); bars are rasterized so saving at
+    # high DPI encodes them as one image layer instead of hundreds of
+    # vector rectangles (axes and text stay vectorized)
+    for j, cap in enumerate(cap_types):
+        bars = ax.barh(
             y_pos - bar_height / 2 - gap / 2,
-            values,
+            ideal_top[:, j],
             bar_height,
-            left=bottom_ideal,
+            left=ideal_left[:, j],
             color=colors.get(cap, "#95a5a6"),
             edgecolor="white",
             linewidth=1.5,
         )
-        bottom_ideal += values
+        for bar in bars:
+            bar.set_rasterized(True)
 
     # Plot actual allocation (bottom bar) - same colors
-    bottom_actual = np.zeros(len(countries_list))
-    for cap in cap_types:
-        values = np.array(actual_data[cap])
-        ax.barh(
+    for j, cap in enumerate(cap_types):
+        bars = ax.barh(
             y_pos + bar_height / 2 + gap / 2,
-            values,
+            actual_top[:, j],
             bar_height,
-            left=bottom_actual,
+            left=actual_left[:, j],
             color=colors.get(cap, "#95a5a6"),
             edgecolor="white",
             linewidth=1.5,
         )
-        bottom_actual += values
+        for bar in bars:
+            bar.set_rasterized(True)
 
     # Use standard log scale
     ax.set_xscale("log")
@@ -304,32 +335,30 @@ def plot_country_level_comparison(
     )
     ax.grid(axis="x", alpha=0.3, linestyle="--", which="both")
 
-    # Add text annotations showing coverage percentage
-    for i, (country, ideal, actual) in enumerate(zip(countries_list, ideal_totals, actual_totals)):
-        if ideal > 0:
-            coverage_pct = (actual / ideal) * 100
-            if coverage_pct < 50:
-                color = "#e74c3c"  # Red for low coverage
-                symbol = "⚠️"
-                text = f"{symbol} {coverage_pct:.0f}%"
-            elif coverage_pct < 100:
-                color = "#f39c12"  # Orange for partial
-                symbol = "◐"
-                text = f"{symbol} {coverage_pct:.0f}%"
-            else:  # coverage_pct >= 100
-                color = "#2ecc71"  # Green for complete
-                symbol = "●"
-                text = f"{symbol} 100%"
-
-            # Place annotation to the right of the bars
-            max_val = max(ideal, actual)
-            ax.text(max_val * 1.5, i, text, va="center", fontsize=8, color=color, fontweight="bold")
+    # Add text annotations showing coverage percentage; the per-row
+    # threshold branches collapse into np.select over the totals
+    # (red for low coverage, orange for partial, green for complete)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        coverage_pct = np.where(ideal_totals > 0, actual_totals / ideal_totals * 100, 0.0)
+    partial = [coverage_pct < 50, coverage_pct < 100]
+    note_colors = np.select(partial, ["#e74c3c", "#f39c12"], default="#2ecc71")
+    symbols = np.select(partial, ["⚠️", "◐"], default="●")
+    pct_text = np.where(coverage_pct >= 100, "100%", np.char.mod("%.0f%%", coverage_pct))
+    notes = np.char.add(np.char.add(symbols, " "), pct_text)
+
+    # Place annotations to the right of the bars
+    note_x = np.maximum(ideal_totals, actual_totals) * 1.5
+    note_kwargs = {"va": "center", "fontsize": 8, "fontweight": "bold"}
+    for i in np.flatnonzero(ideal_totals > 0):
+        ax.text(note_x[i], i, notes[i], color=note_colors[i], **note_kwargs)
 
     plt.tight_layout()
 
     if output_path:
         plt.savefig(output_path, dpi=300, bbox_inches="tight")
         print(f"✅ Saved country-level comparison to {output_path}")
+        # saved figures are never shown; close so batch renders stay O(1)
+        plt.close(fig)
     else:
         plt.show()
 
@@ -346,6 +375,8 @@ def plot_all_visualizations(portfolio_file, output_dir=None):
     """
     print(f"📊 Generating visualizations for {portfolio_file}...")
 
+    import pandas as pd
+
     # Load configuration
     region_groupings, all_countries = load_regions()
     config = read_yaml("config.yaml")
@@ -356,18 +387,24 @@ def plot_all_visualizations(portfolio_file, output_dir=None):
     portfolio = read_yaml(portfolio_file)
 
     # Fetch country weights
-    df = fetch_country_weights(imid_url)
-
-    # Add missing countries
-    missing_countries = set(all_countries) - set(df["Country"])
-    for country in missing_countries:
-        df.loc[len(df)] = {"Country": country, "Weight": 0.00}
-
-    # Build region weights
-    region_weights = {}
-    for region_name, countries in region_groupings.items():
-        region_weight = df[df["Country"].isin(countries)]["Weight"].sum()
-        region_weights[region_name] = region_weight
+    df = _cached_weights(imid_url)
+
+    # Add missing countries in one concat; growing the frame row by row
+    # through df.loc[len(df)] reallocates the whole index each time
+    missing_countries = sorted(set(all_countries) - set(df["Country"]))
+    if missing_countries:
+        missing_df = pd.DataFrame({"Country": missing_countries, "Weight": 0.00})
+        df = pd.concat([df, missing_df], ignore_index=True)
+
+    # Sort by weight once; both plots take their top slice from this view
+    df = df.sort_values("Weight", ascending=False, kind="stable", ignore_index=True)
+
+    # Resolve each sector to its countries once; both plots reuse the mapping
+    sector_countries = {
+        sector: get_countries_for_sector(sector, region_groupings, all_countries)
+        for sector in portfolio
+    }
+    cap_types = sorted(market_cap_pct.keys(), key=lambda x: market_cap_pct[x], reverse=True)
 
     # Create output directory if specified
     if output_dir:
@@ -382,6 +419,8 @@ def plot_all_visualizations(portfolio_file, output_dir=None):
             all_countries,
             market_cap_pct,
             f"{output_dir}/{portfolio_name}_heatmap.png",
+            sector_countries=sector_countries,
+            cap_types=cap_types,
         )
         plot_country_level_comparison(
             portfolio,
@@ -390,12 +429,28 @@ def plot_all_visualizations(portfolio_file, output_dir=None):
             all_countries,
             market_cap_pct,
             f"{output_dir}/{portfolio_name}_country_detail.png",
+            sector_countries=sector_countries,
+            cap_types=cap_types,
         )
     else:
         # Show plots interactively (pass df for country weights)
-        plot_coverage_heatmap(portfolio, df, region_groupings, all_countries, market_cap_pct)
+        plot_coverage_heatmap(
+            portfolio,
+            df,
+            region_groupings,
+            all_countries,
+            market_cap_pct,
+            sector_countries=sector_countries,
+            cap_types=cap_types,
+        )
         plot_country_level_comparison(
-            portfolio, df, region_groupings, all_countries, market_cap_pct
+            portfolio,
+            df,
+            region_groupings,
+            all_countries,
+            market_cap_pct,
+            sector_countries=sector_countries,
+            cap_types=cap_types,
         )
 
     print("✅ Visualization complete!")
@@ -416,6 +471,13 @@ def main():
 
     args = parser.parse_args()
 
+    if args.output:
+        # nothing is shown on screen; the Agg canvas skips the interactive
+        # backend's window and event-loop setup
+        import matplotlib
+
+        matplotlib.use("Agg")
+
     try:
         plot_all_visualizations(args.file, args.output)
     except FileNotFoundError as e: